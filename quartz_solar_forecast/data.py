@@ -1,5 +1,4 @@
 """ Function to get NWP data and create fake PV dataset"""
-import json
 import ssl
 from datetime import datetime
 import os  # Add import for os module
@@ -9,6 +8,12 @@ import pandas as pd
 import requests
 import xarray as xr
 
+# orjson parses the number heavy Open-Meteo responses much faster, but is optional
+try:
+    import orjson as json
+except ImportError:
+    import json
+
 from quartz_solar_forecast.pydantic_models import PVSite
 from quartz_solar_forecast.inverters.enphase import get_enphase_data # Added import for get_enphase_data from /inverters/enphase.py
 
@@ -56,25 +61,22 @@ def get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon") -> xr.Dataset:
         raise Exception(f'Source ({nwp_source}) must be either "icon" or "gfs"')
 
     # Pull data from the nwp_source provided 
-    url = (
-        f"https://api.open-meteo.com/v1/{url_nwp_source}?"
-        f"latitude={site.latitude}&longitude={site.longitude}"
-        f"&hourly={','.join(variables)}"
-        f"&start_date={start}&end_date={end}"
-    )
-    r = requests.get(url)
-    d = json.loads(r.text)
+    params = {
+        "latitude": site.latitude,
+        "longitude": site.longitude,
+        "hourly": ",".join(variables),
+        "start_date": start,
+        "end_date": end,
+    }
+    r = requests.get(f"https://api.open-meteo.com/v1/{url_nwp_source}", params=params)
+    d = json.loads(r.content)
 
     # If the nwp_source is ICON, get visibility data from GFS as its not available for icon on Open Meteo
     if nwp_source == "icon":
-        url = (
-            f"https://api.open-meteo.com/v1/gfs?"
-            f"latitude={site.latitude}&longitude={site.longitude}"
-            f"&hourly=visibility"
-            f"&start_date={start}&end_date={end}"
+        r_gfs = requests.get(
+            "https://api.open-meteo.com/v1/gfs", params={**params, "hourly": "visibility"}
         )
-        r_gfs = requests.get(url)
-        d_gfs = json.loads(r_gfs.text)
+        d_gfs = json.loads(r_gfs.content)
 
         # extract visibility data from gfs reponse
         gfs_visibility_data = d_gfs["hourly"]["visibility"]
@@ -82,9 +84,19 @@ def get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon") -> xr.Dataset:
         # add visibility to the icon reponse to make a complete json file 
         d["hourly"]["visibility"] = gfs_visibility_data
 
-    # convert data into xarray
-    df = pd.DataFrame(d["hourly"])
-    df["time"] = pd.to_datetime(df["time"])
+    # convert data into xarray, the variables are built as float64 arrays (missing values become
+    # NaN) instead of letting pandas infer the dtype from the lists. They stay float64, as the
+    # pretrained psp model of forecast_v1 was run on float64 inputs
+    df = pd.DataFrame(
+        {
+            name: np.asarray(values, dtype=np.float64)
+            for name, values in d["hourly"].items()
+            if name != "time"
+        }
+    )
+    # the times are fixed format "YYYY-MM-DDTHH:MM" strings, numpy parses them directly without
+    # the format inference of pd.to_datetime
+    df["time"] = np.asarray(d["hourly"]["time"], dtype="datetime64[m]").astype("datetime64[ns]")
     df = df.rename(
         columns={
             "visibility": "vis",
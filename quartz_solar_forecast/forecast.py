@@ -1,5 +1,7 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import pandas as pd
 
@@ -53,26 +55,115 @@ def run_xgboost_forecast(
     :return: The PV forecast of the site for time (ts) for 48 hours
     """
     solar_power_predictor = SolarPowerPredictor(model_path=model_path)
-
-    if ts is None:
-        start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
-        start_time = pd.Timestamp.now().floor('15min')
-    else:
-        start_time = pd.to_datetime(ts)
-
-    end_time = start_time + pd.Timedelta(hours=48)
+    start_time, end_time = _xgboost_forecast_window(ts)
 
     predictions = solar_power_predictor.predict_power_output(
         latitude=site.latitude,
         longitude=site.longitude,
-        start_date=start_date,
+        start_date=start_time,
         kwp=site.capacity_kwp,
         orientation=site.orientation,
         tilt=site.tilt,
+        start_time=start_time,
+        end_time=end_time,
+    )
+
+    return _format_xgboost_predictions(predictions)
+
+
+def run_xgboost_forecast_batch(
+    sites: List[PVSite],
+    model_path: str,
+    ts: Optional[str] = None,
+) -> List[pd.DataFrame]:
+    """
+    Run the forecast using the XGBoost model for several sites
+
+    The weather data of all sites is fetched concurrently.
+
+    :param sites: the PV sites
+    :param model_path: the path to the XGBoost model
+    :param ts: the start date of the forecast. If None, defaults to the current date.
+    :return: The PV forecast of each site for time (ts) for 48 hours, in the order of sites
+    """
+    solar_power_predictor = SolarPowerPredictor(model_path=model_path)
+    start_time, end_time = _xgboost_forecast_window(ts)
+
+    predictions = solar_power_predictor.predict_power_output_batch(
+        sites, start_date=start_time, start_time=start_time, end_time=end_time
     )
 
-    predictions = predictions[(predictions['date'] >= start_time) & (predictions['date'] < end_time)]
-    predictions = predictions.reset_index(drop=True)
+    return [_format_xgboost_predictions(site_predictions) for site_predictions in predictions]
+
+
+def run_xgboost_forecast_parallel(
+    sites: List[PVSite],
+    model_path: str,
+    ts: Optional[str] = None,
+    n_workers: int = 4,
+) -> List[pd.DataFrame]:
+    """
+    Run the forecast using the XGBoost model for several sites, in parallel worker threads
+
+    Each worker forecasts one site at a time, and the cores are shared between the workers so
+    XGBoost's own threads do not oversubscribe them.
+
+    :param sites: the PV sites
+    :param model_path: the path to the XGBoost model
+    :param ts: the start date of the forecast. If None, defaults to the current date.
+    :param n_workers: the number of worker threads
+    :return: The PV forecast of each site for time (ts) for 48 hours, in the order of sites
+    """
+    if n_workers < 1:
+        raise ValueError(f"n_workers must be at least 1, got {n_workers}")
+
+    solar_power_predictor = SolarPowerPredictor(
+        model_path=model_path, n_threads=max(1, (os.cpu_count() or 1) // n_workers)
+    )
+    start_time, end_time = _xgboost_forecast_window(ts)
+
+    def forecast_site(site: PVSite) -> pd.DataFrame:
+        predictions = solar_power_predictor.predict_power_output(
+            latitude=site.latitude,
+            longitude=site.longitude,
+            start_date=start_time,
+            kwp=site.capacity_kwp,
+            orientation=site.orientation,
+            tilt=site.tilt,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        return _format_xgboost_predictions(predictions)
+
+    # the GIL is released while waiting for the weather API and inside XGBoost
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(forecast_site, sites))
+
+
+def _xgboost_forecast_window(ts: Optional[str]) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Get the start and end times of the XGBoost forecast
+
+    :param ts: the start date of the forecast. If None, defaults to now, floored to 15 minutes.
+        A timezone aware ts is converted to UTC.
+    :return: The start and end times of the forecast, naive like the dates of the weather data
+    """
+    if ts is None:
+        start_time = pd.Timestamp.now().floor('15min')
+    else:
+        start_time = pd.to_datetime(ts)
+        if start_time.tzinfo is not None:
+            start_time = start_time.tz_convert("UTC").tz_localize(None)
+
+    end_time = start_time + pd.Timedelta(hours=48)
+
+    return start_time, end_time
+
+
+def _format_xgboost_predictions(predictions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Index the predictions by date
+    """
     predictions.set_index("date", inplace=True)
 
     return predictions
@@ -1,10 +1,68 @@
 import datetime
+import functools
+import os
+from typing import List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from joblib import load
 
+from quartz_solar_forecast.pydantic_models import PVSite
 from quartz_solar_forecast.weather import WeatherService
 
+# Treelite is optional, it is only used to run the model compiled to a shared library
+try:
+    import tl2cgen
+    import treelite
+except ImportError:
+    tl2cgen = None
+    treelite = None
+
+DATE_FEATURES = ["year", "month", "day", "hour", "minute"]
+PANEL_COLUMNS = ["latitude_rounded", "longitude_rounded", "orientation", "tilt", "kwp"]
+
+
+def _date_features(dates: np.ndarray) -> np.ndarray:
+    """
+    Splits datetime64 values into year, month, day, hour and minute.
+
+    Truncating the dates to each unit and subtracting the next coarser unit gives all features
+    with a few vectorized numpy operations, without the pandas .dt accessor.
+
+    Parameters
+    ----------
+    dates : np.ndarray
+        The datetime64 values.
+
+    Returns
+    -------
+    np.ndarray
+        int16 array with one row per date and one column per feature in DATE_FEATURES.
+    """
+    years = dates.astype("datetime64[Y]")
+    months = dates.astype("datetime64[M]")
+    days = dates.astype("datetime64[D]")
+    hours = dates.astype("datetime64[h]")
+
+    features = np.empty((len(dates), len(DATE_FEATURES)), dtype=np.int16)
+    features[:, 0] = years.astype(np.int64) + 1970
+    features[:, 1] = (months - years).astype(np.int64) + 1
+    features[:, 2] = (days - months).astype(np.int64) + 1
+    features[:, 3] = (hours - days).astype(np.int64)
+    features[:, 4] = (dates.astype("datetime64[m]") - hours).astype(np.int64)
+    return features
+
+
+@functools.lru_cache(maxsize=4)
+def _load_model(model_path: str, modified_time: float):
+    """
+    Loads the model from a joblib file, memoized so that it is only deserialized once.
+
+    The modification time of the file is part of the cache key, so a model file that is
+    replaced on disk is loaded again.
+    """
+    return load(model_path)
+
 
 class SolarPowerPredictor:
     """
@@ -18,21 +76,34 @@ class SolarPowerPredictor:
 
     Methods
     -------
-    predict_power_output(latitude: float, longitude: float, start_date: str, kwp: float,
-        orientation: float, tilt: float) -> pd.DataFrame:
+    predict_power_output(latitude: float, longitude: float, start_date: str | datetime.date,
+        kwp: float, orientation: float, tilt: float) -> pd.DataFrame:
 
         Predicts solar power output for the given parameters.
 
+    predict_power_output_batch(sites: List[PVSite],
+        start_date: str | datetime.date) -> List[pd.DataFrame]:
+
+        Predicts solar power output for several sites, fetching their weather data concurrently.
+
     plot(predictions: pd.DataFrame) -> None:
             Plots the predictions.
     """
 
-    def __init__(self, model_path: str) -> None:
+    def __init__(
+        self, model_path: str, compile_model: bool = False, n_threads: Optional[int] = None
+    ) -> None:
         """
         Parameters
         ----------
         model_path : str
             Path to the trained model joblib file.
+        compile_model : bool
+            Compile the model with Treelite if there is no compiled model next to the joblib
+            file yet. Compiling takes a while, but only has to be done once per model file.
+            Requires the optional treelite and tl2cgen packages, and a C compiler.
+        n_threads : int, optional
+            Number of threads used by each prediction. Defaults to all cores.
         """
         if not model_path:
             raise ValueError("Model path must be provided")
@@ -40,16 +111,67 @@ class SolarPowerPredictor:
         if model_path.split(".")[-1] != "joblib":
             raise ValueError("Model file must be a joblib file")
 
-        self.model = load(model_path)
+        self.model = _load_model(model_path, os.path.getmtime(model_path))
+        self.booster = self.model.get_booster()
+        self.n_threads = n_threads
+        if n_threads is not None:
+            # the loaded model is shared between instances, so the thread count is set on a copy
+            self.booster = self.booster.copy()
+            self.booster.set_param({"nthread": n_threads})
+        # use the trees up to the best iteration, like XGBRegressor.predict does
+        try:
+            self.iteration_range = (0, self.booster.best_iteration + 1)
+        except AttributeError:
+            self.iteration_range = (0, 0)
+        self.predictor = self._load_compiled_predictor(model_path, compile_model)
+
+    def _load_compiled_predictor(
+        self, model_path: str, compile_model: bool
+    ) -> Optional["tl2cgen.Predictor"]:
+        """
+        Loads the model compiled with Treelite, which is stored next to the joblib file with a
+        .so extension.
+
+        Returns None if the compiled model is not available, in which case the XGBoost booster is
+        used for prediction.
+        """
+        # the compiled model treats NaN as missing, it is not used for models with another value
+        if tl2cgen is None or not np.isnan(self.model.missing):
+            return None
+
+        libpath = os.path.splitext(model_path)[0] + ".so"
+        is_compiled = os.path.exists(libpath) and os.path.getmtime(libpath) >= os.path.getmtime(
+            model_path
+        )
+        if not is_compiled:
+            if not compile_model:
+                return None
+            booster = self.booster
+            if self.iteration_range[1] > 0:
+                booster = booster[self.iteration_range[0] : self.iteration_range[1]]
+            tl2cgen.export_lib(
+                treelite.frontend.from_xgboost(booster),
+                toolchain="gcc",
+                libpath=libpath,
+                params={"parallel_comp": os.cpu_count()},
+            )
+
+        # unlike XGBoost, Treelite fails on more threads than there are cores
+        nthread = self.n_threads
+        if nthread is not None:
+            nthread = min(nthread, os.cpu_count() or 1)
+        return tl2cgen.Predictor(libpath, nthread=nthread)
 
     def get_data(
         self,
         latitude: float,
         longitude: float,
-        start_date: str,
+        start_date: Union[str, datetime.date],
         kwp: float,
         orientation: float,
         tilt: float,
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
     ) -> pd.DataFrame:
         """
         Fetches weather data for the given location and date range, and prepares it for prediction.
@@ -60,29 +182,34 @@ class SolarPowerPredictor:
             Latitude of the location.
         longitude : float
             Longitude of the location.
-        start_date : str
-            Start date in 'YYYY-MM-DD' format.
+        start_date : str or datetime.date
+            Start date in 'YYYY-MM-DD' format, or a date or datetime of which the date is used.
         kwp : float
             Kilowatt peak of the solar panel system.
         orientation : float
             Orientation angle of the solar panel system in degrees.
         tilt : float
             Tilt angle of the solar panel system in degrees.
+        start_time : datetime.datetime, optional
+            Only keep the data from this time on. Naive times are in UTC, like the weather data.
+        end_time : datetime.datetime, optional
+            Only keep the data before this time. If None, the data of start_date and the 2 days
+            after it is kept.
 
         Returns
         -------
         pd.DataFrame
             Prepared weather data with additional solar panel parameters.
         """
-        start_date_datetime = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        end_date_datetime = start_date_datetime + datetime.timedelta(days=2)
-        end_date = end_date_datetime.strftime("%Y-%m-%d")
+        start_time, end_time = self._to_naive_utc(start_time), self._to_naive_utc(end_time)
+        start_date_datetime = self._start_of_day(start_date)
+        start_date = start_date_datetime.date().isoformat()
+        end_date = self._get_end_date(start_date_datetime, end_time)
 
         weather_service = WeatherService()
 
         # Check if the start date is more than 3 months ago
         three_months_ago = datetime.datetime.today() - datetime.timedelta(days=3 * 30)
-        weather_service = WeatherService()
 
         if start_date_datetime < three_months_ago:
             weather_data = weather_service.get_historical_weather(
@@ -97,26 +224,156 @@ class SolarPowerPredictor:
                 latitude, longitude, start_date, end_date
             )
 
-        PANEL_COLUMNS = [
-            "latitude_rounded",
-            "longitude_rounded",
-            "orientation",
-            "tilt",
-            "kwp",
+        weather_data = self._select_time_range(weather_data, start_time, end_time)
+        return self._add_panel_columns(weather_data, latitude, longitude, kwp, orientation, tilt)
+
+    def get_data_batch(
+        self,
+        sites: List[PVSite],
+        start_date: Union[str, datetime.date],
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
+    ) -> List[pd.DataFrame]:
+        """
+        Fetches weather data for several sites, and prepares it for prediction.
+
+        Weather forecasts for all sites are requested concurrently.
+
+        Parameters
+        ----------
+        sites : List[PVSite]
+            The PV sites.
+        start_date : str or datetime.date
+            Start date in 'YYYY-MM-DD' format, or a date or datetime of which the date is used.
+        start_time : datetime.datetime, optional
+            Only keep the data from this time on. Naive times are in UTC, like the weather data.
+        end_time : datetime.datetime, optional
+            Only keep the data before this time. If None, the data of start_date and the 2 days
+            after it is kept.
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            Prepared weather data with additional solar panel parameters, for each site.
+        """
+        start_time, end_time = self._to_naive_utc(start_time), self._to_naive_utc(end_time)
+        start_date_datetime = self._start_of_day(start_date)
+        start_date = start_date_datetime.date().isoformat()
+        three_months_ago = datetime.datetime.today() - datetime.timedelta(days=3 * 30)
+        if start_date_datetime < three_months_ago:
+            return [
+                self.get_data(
+                    site.latitude,
+                    site.longitude,
+                    start_date,
+                    site.capacity_kwp,
+                    site.orientation,
+                    site.tilt,
+                    start_time,
+                    end_time,
+                )
+                for site in sites
+            ]
+
+        end_date = self._get_end_date(start_date_datetime, end_time)
+
+        weather_service = WeatherService()
+        weather_data = weather_service.get_minutely_weather_batch(
+            [(site.latitude, site.longitude, start_date, end_date) for site in sites]
+        )
+
+        return [
+            self._add_panel_columns(
+                self._select_time_range(data, start_time, end_time),
+                site.latitude,
+                site.longitude,
+                site.capacity_kwp,
+                site.orientation,
+                site.tilt,
+            )
+            for data, site in zip(weather_data, sites)
         ]
 
-        weather_data["latitude_rounded"] = latitude
-        weather_data["longitude_rounded"] = longitude
-        weather_data["orientation"] = orientation
-        weather_data["tilt"] = tilt
-        weather_data["kwp"] = kwp
+    @staticmethod
+    def _to_naive_utc(time: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+        """
+        Converts a timezone aware time to naive UTC, like the dates of the weather data.
+        """
+        if time is None or time.tzinfo is None:
+            return time
+        return time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def _start_of_day(start_date: Union[str, datetime.date]) -> datetime.datetime:
+        """
+        Gets midnight of the start date, which may also be given in 'YYYY-MM-DD' format.
+        """
+        if isinstance(start_date, str):
+            return datetime.datetime.strptime(start_date, "%Y-%m-%d")
+        if isinstance(start_date, datetime.datetime):
+            # the UTC date of a timezone aware datetime
+            start_date = SolarPowerPredictor._to_naive_utc(start_date)
+        return datetime.datetime.combine(start_date, datetime.time())
+
+    @staticmethod
+    def _get_end_date(
+        start_date_datetime: datetime.datetime, end_time: Optional[datetime.datetime]
+    ) -> str:
+        """
+        Gets the last date, in 'YYYY-MM-DD' format, to fetch weather data for.
+        """
+        if end_time is None:
+            end_date_datetime = start_date_datetime + datetime.timedelta(days=2)
+        else:
+            # end_time is exclusive, while the end date of the weather APIs is inclusive
+            end_date_datetime = max(
+                end_time - datetime.timedelta(microseconds=1), start_date_datetime
+            )
+        return end_date_datetime.date().isoformat()
+
+    @staticmethod
+    def _select_time_range(
+        weather_data: pd.DataFrame,
+        start_time: Optional[datetime.datetime],
+        end_time: Optional[datetime.datetime],
+    ) -> pd.DataFrame:
+        """
+        Keeps the rows of the weather data from start_time up to, but excluding, end_time.
+        """
+        if start_time is None and end_time is None:
+            return weather_data
+
+        # the dates are sorted, so the time range is a slice of the rows
+        dates = weather_data["date"].values
+        start = 0 if start_time is None else dates.searchsorted(np.datetime64(start_time))
+        end = len(dates) if end_time is None else dates.searchsorted(np.datetime64(end_time))
+        return weather_data.iloc[start:end].reset_index(drop=True)
+
+    @staticmethod
+    def _add_panel_columns(
+        weather_data: pd.DataFrame,
+        latitude: float,
+        longitude: float,
+        kwp: float,
+        orientation: float,
+        tilt: float,
+    ) -> pd.DataFrame:
+        """
+        Adds the solar panel parameters to the weather data.
 
-        cols = PANEL_COLUMNS + [col for col in weather_data.columns if col not in PANEL_COLUMNS]
-        weather_data = weather_data[cols]
+        The columns are not reordered, the features are put in the model's order at prediction,
+        which is PANEL_COLUMNS first for models without feature names.
+        """
+        # float32 like the weather variables, XGBoost converts all features to float32 anyway
+        weather_data["latitude_rounded"] = np.float32(latitude)
+        weather_data["longitude_rounded"] = np.float32(longitude)
+        weather_data["orientation"] = np.float32(orientation)
+        weather_data["tilt"] = np.float32(tilt)
+        weather_data["kwp"] = np.float32(kwp)
 
         return weather_data
 
-    def clean(self, df: pd.DataFrame) -> pd.DataFrame:
+    def clean(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
         """
         Cleans and transforms the input DataFrame.
 
@@ -127,27 +384,28 @@ class SolarPowerPredictor:
 
         Returns
         -------
-        pd.DataFrame
-            Transformed DataFrame ready for prediction.
+        Tuple[pd.DataFrame, pd.Series]
+            Transformed DataFrame ready for prediction, and the dates of its rows.
         """
         date_column = "date"
-        df.loc[:, date_column] = pd.to_datetime(df[date_column])
-        df["year"] = df[date_column].dt.year
-        df["month"] = df[date_column].dt.month
-        df["day"] = df[date_column].dt.day
-        df["hour"] = df[date_column].dt.hour
-        df["minute"] = df[date_column].dt.minute
-        df = df.drop(columns=[date_column])
-        return df
+        dates = pd.to_datetime(df[date_column])
+        # all date features are added as one int16 block
+        date_features = pd.DataFrame(
+            _date_features(dates.values), columns=DATE_FEATURES, index=df.index, copy=False
+        )
+        cleaned_df = pd.concat([df.drop(columns=[date_column]), date_features], axis=1)
+        return cleaned_df, dates
 
     def predict_power_output(
         self,
         latitude: float,
         longitude: float,
-        start_date: str,
+        start_date: Union[str, datetime.date],
         kwp: float,
         orientation: float,
         tilt: float,
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
     ) -> pd.DataFrame:
         """
         Predicts solar power output for the specified parameters.
@@ -158,14 +416,19 @@ class SolarPowerPredictor:
             Latitude of the location.
         longitude : float
             Longitude of the location.
-        start_date : str
-            Start date in 'YYYY-MM-DD' format.
+        start_date : str or datetime.date
+            Start date in 'YYYY-MM-DD' format, or a date or datetime of which the date is used.
         kwp : float
             Kilowatt peak of the solar panel system.
         orientation : float
             Orientation angle of the solar panel system in degrees.
         tilt : float
             Tilt angle of the solar panel system in degrees.
+        start_time : datetime.datetime, optional
+            Only keep predictions from this time on. Naive times are in UTC, like the weather data.
+        end_time : datetime.datetime, optional
+            Only keep predictions before this time. If None, predictions for start_date and the 2
+            days after it are kept.
 
         Returns
         -------
@@ -173,12 +436,78 @@ class SolarPowerPredictor:
             DataFrame containing timestamps and predicted power output in kW for every 15 minutes.
         """
         print(f"Using start date: {start_date}")
-        data = self.get_data(latitude, longitude, start_date, kwp, orientation, tilt)
-        cleaned_data = self.clean(data)
-        predictions = self.model.predict(cleaned_data)
-        predictions_df = pd.DataFrame(predictions, columns=["prediction"])
-        final_data = cleaned_data.join(predictions_df)
-        final_data["date"] = pd.to_datetime(final_data[["year", "month", "day", "hour", "minute"]])
-        df = final_data[["date", "prediction"]]
-        df = df.rename(columns={"prediction": "power_wh"})
-        return df
+        data = self.get_data(
+            latitude, longitude, start_date, kwp, orientation, tilt, start_time, end_time
+        )
+        return self._predict([data])[0]
+
+    def predict_power_output_batch(
+        self,
+        sites: List[PVSite],
+        start_date: Union[str, datetime.date],
+        start_time: Optional[datetime.datetime] = None,
+        end_time: Optional[datetime.datetime] = None,
+    ) -> List[pd.DataFrame]:
+        """
+        Predicts solar power output for several sites, with a single call to the model.
+
+        Parameters
+        ----------
+        sites : List[PVSite]
+            The PV sites.
+        start_date : str or datetime.date
+            Start date in 'YYYY-MM-DD' format, or a date or datetime of which the date is used.
+        start_time : datetime.datetime, optional
+            Only keep predictions from this time on. Naive times are in UTC, like the weather data.
+        end_time : datetime.datetime, optional
+            Only keep predictions before this time. If None, predictions for start_date and the 2
+            days after it are kept.
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            DataFrames containing timestamps and predicted power output in kW for every 15 minutes,
+            in the order of sites.
+        """
+        return self._predict(self.get_data_batch(sites, start_date, start_time, end_time))
+
+    def _predict(self, data: List[pd.DataFrame]) -> List[pd.DataFrame]:
+        """
+        Predicts solar power output from the data prepared by `get_data`, for each site.
+
+        The data of all sites is concatenated so the model is only called once.
+        """
+        if not data:
+            return []
+        cleaned_data, dates = zip(*(self.clean(site_data) for site_data in data))
+        cleaned_data = pd.concat(cleaned_data, ignore_index=True)
+        dates = pd.concat(dates, ignore_index=True)
+        # predicting from a float32 array skips the DataFrame conversion inside XGBoost, the
+        # array is filled column by column in the order of the features the model was trained on
+        feature_names = self.booster.feature_names
+        if feature_names is None:
+            # models trained without feature names get the order of the training data: the panel
+            # columns, the weather variables and then the date features
+            weather_columns = [
+                column
+                for column in cleaned_data.columns
+                if column not in PANEL_COLUMNS and column not in DATE_FEATURES
+            ]
+            feature_names = PANEL_COLUMNS + weather_columns + DATE_FEATURES
+        X = np.empty((len(cleaned_data), len(feature_names)), dtype=np.float32)
+        for i, feature_name in enumerate(feature_names):
+            X[:, i] = cleaned_data[feature_name].to_numpy()
+        if self.predictor is not None:
+            predictions = self.predictor.predict(tl2cgen.DMatrix(X)).reshape(-1)
+        else:
+            predictions = self.booster.inplace_predict(
+                X, iteration_range=self.iteration_range, missing=self.model.missing
+            )
+        df = pd.DataFrame({"date": dates.values, "power_wh": predictions}, copy=False)
+
+        # split the predictions back into one DataFrame per site
+        ends = np.cumsum([len(site_data) for site_data in data])
+        return [
+            df.iloc[end - len(site_data) : end].reset_index(drop=True)
+            for end, site_data in zip(ends, data)
+        ]
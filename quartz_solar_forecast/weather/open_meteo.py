@@ -1,7 +1,187 @@
-from datetime import datetime
+import asyncio
+import calendar
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 
+import aiohttp
+import numpy as np
 import openmeteo_requests
 import pandas as pd
+import requests
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+
+# Processed responses are cached on disk, with a small in-memory LRU in front of it. Setting
+# QUARTZ_SOLAR_FORECAST_CACHE_DIR to an empty string disables the on-disk cache. Cache files are
+# loaded with pd.read_pickle, so the directory must only be writable by trusted users.
+CACHE_DIR = os.getenv(
+    "QUARTZ_SOLAR_FORECAST_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "quartz_solar_forecast", "open_meteo"),
+)
+# Cache files older than this are deleted, so the cache does not grow without bound. They are
+# pruned when a response is saved, at most once per CACHE_PRUNE_INTERVAL seconds.
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+CACHE_PRUNE_INTERVAL = 60 * 60
+# Forecasts are refreshed by Open-Meteo, so cached forecast data expires after an hour
+CACHE_EXPIRE_AFTER = 60 * 60
+# Days after which past data of the forecast API no longer changes and is cached without expiry
+FINAL_DATA_AFTER_DAYS = 2
+# Processed responses kept in memory, enough for a batch of a few hundred sites (a week of
+# 15 minutely data is ~50 kB)
+MEMORY_CACHE_SIZE = 512
+# (connect, read) timeouts in seconds, so a stalled connection cannot block a forecast forever
+REQUEST_TIMEOUT = (3.05, 30)
+# requests sent at once by a batch, so large batches do not run into the API rate limit
+MAX_CONCURRENT_REQUESTS = 16
+
+
+class OpenMeteoRateLimitError(OpenMeteoRequestsError):
+    """The OpenMeteo API rejected a request with a 429, as the rate limit was exceeded."""
+
+
+def _rate_limit_error(body: str) -> OpenMeteoRateLimitError:
+    """Make the error of a rate limited request, from its JSON (or plain text) error body."""
+    try:
+        return OpenMeteoRateLimitError(json.loads(body))
+    except ValueError:
+        return OpenMeteoRateLimitError(body)
+
+
+# Errors of unreachable, failing or rate limited API requests, on which expired cached data is
+# used instead. Other OpenMeteoRequestsError (a 400 for invalid parameters) are still raised.
+_FETCH_ERRORS = (
+    requests.RequestException,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    OpenMeteoRateLimitError,
+)
+
+_DATE_RE = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})")
+
+_memory_cache: "OrderedDict[str, Tuple[float, pd.DataFrame]]" = OrderedDict()
+_memory_cache_lock = threading.Lock()
+_disk_cache_pruned_at = 0.0
+
+HOURLY_VARIABLES = (
+    "temperature_2m",
+    "relative_humidity_2m",
+    "dew_point_2m",
+    "precipitation",
+    "surface_pressure",
+    "cloud_cover",
+    "cloud_cover_low",
+    "cloud_cover_mid",
+    "cloud_cover_high",
+    "visibility",
+    "wind_speed_10m",
+    "wind_speed_80m",
+    "wind_speed_120m",
+    "wind_speed_180m",
+    "wind_direction_10m",
+    "wind_direction_80m",
+    "wind_direction_120m",
+    "wind_direction_180m",
+    "is_day",
+    "sunshine_duration",
+    "shortwave_radiation",
+    "direct_radiation",
+    "diffuse_radiation",
+    "direct_normal_irradiance",
+    "terrestrial_radiation",
+)
+
+MINUTELY_15_VARIABLES = (
+    "temperature_2m",
+    "relative_humidity_2m",
+    "dew_point_2m",
+    "precipitation",
+    "surface_pressure",
+    "cloud_cover",
+    "cloud_cover_low",
+    "cloud_cover_mid",
+    "cloud_cover_high",
+    "wind_speed_10m",
+    "wind_direction_10m",
+    "is_day",
+    "shortwave_radiation",
+    "direct_radiation",
+    "diffuse_radiation",
+    "direct_normal_irradiance",
+    "terrestrial_radiation",
+)
+
+# the archive API is queried for the same variables as the 15 minutely forecast
+HISTORICAL_VARIABLES = MINUTELY_15_VARIABLES
+
+# the variables are sent comma separated, the defaults are joined once here instead of for
+# every request
+_FORECAST_VARIABLES_CSV = {
+    "hourly": ",".join(HOURLY_VARIABLES),
+    "minutely_15": ",".join(MINUTELY_15_VARIABLES),
+}
+_HISTORICAL_VARIABLES_CSV = ",".join(HISTORICAL_VARIABLES)
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies REQUEST_TIMEOUT to requests sent without a timeout."""
+
+    def send(self, request, timeout=None, **kwargs):
+        # openmeteo_requests does not pass a timeout, so one is set for every request here
+        return super().send(request, timeout=timeout or REQUEST_TIMEOUT, **kwargs)
+
+
+def _raise_for_rate_limit(response: requests.Response, *args, **kwargs):
+    """Session response hook raising OpenMeteoRateLimitError on a 429."""
+    # openmeteo_requests raises the same OpenMeteoRequestsError for a 400 and a 429, so rate
+    # limits are told apart here, before the client gets the response
+    if response.status_code == 429:
+        raise _rate_limit_error(response.text)
+
+
+_openmeteo_client: Optional[openmeteo_requests.Client] = None
+_openmeteo_client_lock = threading.Lock()
+
+
+def _get_openmeteo_client() -> openmeteo_requests.Client:
+    """
+    Get the openmeteo_requests client shared by the whole process, creating it on first use.
+
+    Sharing the client keeps its connections to the API open between requests, so only the
+    first request pays for the TCP and TLS handshakes.
+    """
+    global _openmeteo_client
+    with _openmeteo_client_lock:
+        if _openmeteo_client is None:
+            session = requests.Session()
+            # enough connections for concurrent requests from several threads, transient
+            # gateway errors are retried on the same pool with a short backoff
+            session.mount(
+                "https://",
+                _TimeoutHTTPAdapter(
+                    pool_connections=16,
+                    pool_maxsize=32,
+                    max_retries=Retry(
+                        total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]
+                    ),
+                ),
+            )
+            session.hooks["response"].append(_raise_for_rate_limit)
+            _openmeteo_client = openmeteo_requests.Client(session=session)
+        return _openmeteo_client
 
 
 class OpenMeteoAPIClient:
@@ -10,10 +190,10 @@ class OpenMeteoAPIClient:
         """
         Initialize the OpenMeteo API client.
 
-        This class handles the interaction with the OpenMeteo API using a cached
-        and retriable session.
+        This class handles the interaction with the OpenMeteo API using a session that is
+        shared by the whole process, so connections are reused between requests.
         """
-        self.openmeteo = openmeteo_requests.Client()
+        self.openmeteo = _get_openmeteo_client()
 
     def get_weather_data(self, url: str, params: dict):
         """
@@ -34,8 +214,125 @@ class OpenMeteoAPIClient:
         return self.openmeteo.weather_api(url, params=params)
 
 
+class AsyncOpenMeteoAPIClient:
+
+    def __init__(self, max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS):
+        """
+        Initialize the asynchronous OpenMeteo API client.
+
+        This class sends several requests to the OpenMeteo API concurrently over one aiohttp
+        session, so they share a single connection pool.
+
+        Parameters
+        ----------
+        max_concurrent_requests : int, optional
+            The maximum number of requests of a batch that are in flight at once.
+        """
+        self.max_concurrent_requests = max_concurrent_requests
+
+    async def _get_weather_data(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        url: str,
+        params: dict,
+    ) -> List[WeatherApiResponse]:
+        # the variables are already comma separated, aiohttp only accepts scalar query values
+        query = {key: str(value) for key, value in params.items()}
+        query["format"] = "flatbuffers"
+
+        async with semaphore, session.get(url, params=query) as response:
+            if response.status == 429:
+                raise _rate_limit_error(await response.text())
+            if response.status == 400:
+                # like openmeteo_requests, the error body is read as JSON whatever its mimetype
+                raise OpenMeteoRequestsError(await response.json(content_type=None))
+            response.raise_for_status()
+            data = await response.read()
+
+        # the body is a sequence of size prefixed flatbuffers messages, one per location
+        messages = []
+        pos = 0
+        while pos < len(data):
+            length = int.from_bytes(data[pos : pos + 4], byteorder="little")
+            messages.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+            pos += length + 4
+        return messages
+
+    async def get_weather_data_batch(
+        self, url: str, params_list: List[dict]
+    ) -> List[List[WeatherApiResponse]]:
+        """
+        Get weather data for several requests from the OpenMeteo API concurrently.
+
+        Parameters
+        ----------
+        url : str
+            The API endpoint URL.
+        params_list : List[dict]
+            The parameters of each API request.
+
+        Returns
+        -------
+        List[List[openmeteo_requests.Response]]
+            List of API responses for each request, in the order of params_list.
+        """
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1]
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            return await asyncio.gather(
+                *(
+                    self._get_weather_data(session, semaphore, url, params)
+                    for params in params_list
+                )
+            )
+
+
+def _run_coroutine(coroutine):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    When an event loop is already running in this thread (e.g. in a Jupyter notebook), the
+    coroutine is run in its own event loop in a worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def _join_variables(variables: Optional[List[str]], default: str) -> str:
+    """
+    Comma join the variables of a request, or return the default variables when None.
+
+    A plain string is rejected, as joining it would split it into single characters, and so is
+    an empty list, as a response without variables cannot be processed.
+    """
+    if variables is None:
+        return default
+    if isinstance(variables, str):
+        raise TypeError(f"variables must be a list of variable names, got the string {variables!r}")
+    if len(variables) == 0:
+        raise ValueError("variables must not be empty, use None for the default variables")
+    return ",".join(variables)
+
+
+def _variable_names(variables) -> List[str]:
+    """Get the variable names of request parameters, either comma joined or as a list."""
+    return variables.split(",") if isinstance(variables, str) else list(variables)
+
+
 class WeatherDataFetcher:
-    def __init__(self, api_client: OpenMeteoAPIClient):
+    def __init__(
+        self,
+        api_client: OpenMeteoAPIClient,
+        async_api_client: Optional[AsyncOpenMeteoAPIClient] = None,
+    ):
         """
         Initialize the WeatherDataFetcher.
 
@@ -43,8 +340,11 @@ class WeatherDataFetcher:
         ----------
         api_client : OpenMeteoAPIClient
             An instance of OpenMeteoAPIClient for API communication.
+        async_api_client : AsyncOpenMeteoAPIClient, optional
+            An instance of AsyncOpenMeteoAPIClient used for batches of requests.
         """
         self.api_client = api_client
+        self.async_api_client = async_api_client or AsyncOpenMeteoAPIClient()
 
     def fetch_data(self, url: str, params: dict, max_retries: int = 5, base_delay: float = 1.0):
         """
@@ -65,8 +365,66 @@ class WeatherDataFetcher:
         responses = self.api_client.get_weather_data(url, params)
         return responses[0]
 
+    def fetch_data_batch(self, url: str, params_list: List[dict]) -> list:
+        """
+        Fetch weather data for several requests from the OpenMeteo API concurrently.
+
+        Parameters
+        ----------
+        url : str
+            The API endpoint URL.
+        params_list : List[dict]
+            The parameters of each API request.
+
+        Returns
+        -------
+        List[openmeteo_requests.Response]
+            The API response of each request, in the order of params_list.
+        """
+        responses = _run_coroutine(self.async_api_client.get_weather_data_batch(url, params_list))
+        return [response[0] for response in responses]
+
 
 class WeatherDataProcessor:
+    @staticmethod
+    def _to_dataframe(variables_with_time, variables: List[str]) -> pd.DataFrame:
+        """
+        Convert one resolution (e.g. hourly) of an API response to a DataFrame.
+
+        Each variable is copied once into a preallocated float32 array with one row per
+        variable, which pandas uses directly as the block backing the DataFrame. The
+        variables are held in a single block, with every column contiguous in memory.
+
+        Parameters
+        ----------
+        variables_with_time : openmeteo_sdk.VariablesWithTime
+            The hourly, or minutely 15, data of the API response.
+        variables : List[str]
+            The variables in the order they were requested in.
+
+        Returns
+        -------
+        pd.DataFrame
+            The data in DataFrame format, with a date column followed by the variables.
+        """
+        n_rows = variables_with_time.Variables(0).ValuesLength() if variables else 0
+        values = np.empty((len(variables), n_rows), dtype=np.float32)
+        for i in range(len(variables)):
+            values[i] = variables_with_time.Variables(i).ValuesAsNumpy()
+        # the transpose is a view, pandas stores it as the block without copying
+        dataframe = pd.DataFrame(values.T, columns=variables, copy=False)
+        dataframe.insert(
+            0,
+            "date",
+            # one date per row, so the number of periods is known without using TimeEnd
+            pd.date_range(
+                start=pd.to_datetime(variables_with_time.Time(), unit="s"),
+                periods=n_rows,
+                freq=pd.Timedelta(seconds=variables_with_time.Interval()),
+            ),
+        )
+        return dataframe
+
     @staticmethod
     def process_minutely_15_data(response, params: dict) -> pd.DataFrame:
         """
@@ -77,27 +435,17 @@ class WeatherDataProcessor:
         response : openmeteo_requests.Response
             The API response containing minutely 15 data.
         params : dict
-            The parameters used in the API request.
+            The parameters used in the API request, with the variables either comma joined or
+            as a list.
 
         Returns
         -------
         pd.DataFrame
             Processed minutely 15 data in DataFrame format.
         """
-        minutely_15 = response.Minutely15()
-        minutely_15_data = {
-            "date": pd.date_range(
-                start=pd.to_datetime(minutely_15.Time(), unit="s"),
-                end=pd.to_datetime(minutely_15.TimeEnd(), unit="s"),
-                freq=pd.Timedelta(seconds=minutely_15.Interval()),
-                inclusive="left",
-            )
-        }
-        for i, variable in enumerate(params["minutely_15"]):
-            minutely_15_data[variable] = minutely_15.Variables(i).ValuesAsNumpy()
-
-        minutely_15_dataframe = pd.DataFrame(data=minutely_15_data)
-        return minutely_15_dataframe
+        return WeatherDataProcessor._to_dataframe(
+            response.Minutely15(), _variable_names(params["minutely_15"])
+        )
 
     @staticmethod
     def process_hourly_data(response, params: dict) -> pd.DataFrame:
@@ -109,27 +457,17 @@ class WeatherDataProcessor:
         response : openmeteo_requests.Response
             The API response containing hourly data.
         params : dict
-            The parameters used in the API request.
+            The parameters used in the API request, with the variables either comma joined or
+            as a list.
 
         Returns
         -------
         pd.DataFrame
             Processed hourly data in DataFrame format.
         """
-        hourly = response.Hourly()
-        hourly_data = {
-            "date": pd.date_range(
-                start=pd.to_datetime(hourly.Time(), unit="s"),
-                end=pd.to_datetime(hourly.TimeEnd(), unit="s"),
-                freq=pd.Timedelta(seconds=hourly.Interval()),
-                inclusive="left",
-            )
-        }
-        for i, variable in enumerate(params["hourly"]):
-            hourly_data[variable] = hourly.Variables(i).ValuesAsNumpy()
-
-        hourly_dataframe = pd.DataFrame(data=hourly_data)
-        return hourly_dataframe
+        return WeatherDataProcessor._to_dataframe(
+            response.Hourly(), _variable_names(params["hourly"])
+        )
 
     @staticmethod
     def process_historical_data(response, params: dict) -> pd.DataFrame:
@@ -141,27 +479,17 @@ class WeatherDataProcessor:
         response : openmeteo_requests.Response
             The API response containing historical data.
         params : dict
-            The parameters used in the API request.
+            The parameters used in the API request, with the variables either comma joined or
+            as a list.
 
         Returns
         -------
         pd.DataFrame
             Processed historical data in DataFrame format.
         """
-        hourly = response.Hourly()
-        historical_data = {
-            "date": pd.date_range(
-                start=pd.to_datetime(hourly.Time(), unit="s"),
-                end=pd.to_datetime(hourly.TimeEnd(), unit="s"),
-                freq=pd.Timedelta(seconds=hourly.Interval()),
-                inclusive="left",
-            )
-        }
-        for i, variable in enumerate(params["hourly"]):
-            historical_data[variable] = hourly.Variables(i).ValuesAsNumpy()
-
-        historical_dataframe = pd.DataFrame(data=historical_data)
-        return historical_dataframe
+        return WeatherDataProcessor._to_dataframe(
+            response.Hourly(), _variable_names(params["hourly"])
+        )
 
 
 class WeatherDataHandler:
@@ -187,11 +515,17 @@ class WeatherDataHandler:
         self.data_fetcher = data_fetcher
         self.data_processor = data_processor
 
-    def get_hourly_weather_data_with_forecast(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
-    ) -> pd.DataFrame:
+    @staticmethod
+    def _forecast_params(
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        resolution: str,
+        variables: Optional[List[str]] = None,
+    ) -> dict:
         """
-        Get hourly weather data with forecast.
+        Make the parameters of a forecast API request.
 
         Parameters
         ----------
@@ -203,57 +537,284 @@ class WeatherDataHandler:
             Start date in format YYYY-MM-DD.
         end_date : str
             End date in format YYYY-MM-DD.
+        resolution : str
+            Either "hourly" or "minutely_15".
+        variables : List[str], optional
+            The variables to request. Defaults to HOURLY_VARIABLES or MINUTELY_15_VARIABLES.
 
         Returns
         -------
-        pd.DataFrame
-            Hourly weather data with forecast.
+        dict
+            The parameters to be sent with the API request.
         """
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
+        return {
             "latitude": latitude,
             "longitude": longitude,
-            "hourly": [
-                "temperature_2m",
-                "relative_humidity_2m",
-                "dew_point_2m",
-                "precipitation",
-                "surface_pressure",
-                "cloud_cover",
-                "cloud_cover_low",
-                "cloud_cover_mid",
-                "cloud_cover_high",
-                "visibility",
-                "wind_speed_10m",
-                "wind_speed_80m",
-                "wind_speed_120m",
-                "wind_speed_180m",
-                "wind_direction_10m",
-                "wind_direction_80m",
-                "wind_direction_120m",
-                "wind_direction_180m",
-                "is_day",
-                "sunshine_duration",
-                "shortwave_radiation",
-                "direct_radiation",
-                "diffuse_radiation",
-                "direct_normal_irradiance",
-                "terrestrial_radiation",
-            ],
+            resolution: _join_variables(variables, _FORECAST_VARIABLES_CSV[resolution]),
             "timezone": "GMT",
             "start_date": start_date,
             "end_date": end_date,
         }
-        key, response = self._get_from_cache_url_params(url, params)
+
+    @staticmethod
+    def _cache_key(url: str, params: dict) -> str:
+        """
+        Make a cache key for an API request.
+
+        Latitude and longitude are rounded to 4 decimals (~10 m) so that nearby requests
+        share one cache entry.
+
+        Parameters
+        ----------
+        url : str
+            The API endpoint URL.
+        params : dict
+            The parameters to be sent with the API request.
+
+        Returns
+        -------
+        str
+            Hex digest identifying the request.
+        """
+        params = dict(params)
+        for coordinate in ("latitude", "longitude"):
+            if coordinate in params:
+                params[coordinate] = round(float(params[coordinate]), 4)
+        payload = json.dumps({"url": url, "params": params}, sort_keys=True)
+        return hashlib.blake2b(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _forecast_final_after(end_date: str) -> float:
+        """
+        Get the time after which the forecast API data of a request no longer changes.
+
+        Parameters
+        ----------
+        end_date : str
+            End date of the request in format YYYY-MM-DD.
+
+        Returns
+        -------
+        float
+            Unix timestamp of the start of the day FINAL_DATA_AFTER_DAYS days after end_date.
+        """
+        end = datetime.fromisoformat(end_date).replace(tzinfo=timezone.utc)
+        return (end + timedelta(days=FINAL_DATA_AFTER_DAYS + 1)).timestamp()
+
+    @staticmethod
+    def _is_fresh(
+        saved_at: float, now: float, expire_after: Optional[float], final_after: Optional[float]
+    ) -> bool:
+        """Tell if a cache entry saved at saved_at can still be used at now."""
+        if expire_after is None or (final_after is not None and saved_at >= final_after):
+            return True
+        return now - saved_at < expire_after
+
+    def _get_from_cache_url_params(
+        self,
+        url: str,
+        params: dict,
+        expire_after: Optional[float] = CACHE_EXPIRE_AFTER,
+        final_after: Optional[float] = None,
+    ) -> Tuple[str, Optional[pd.DataFrame]]:
+        """
+        Look up a processed API response in the in-memory and on-disk caches.
+
+        On-disk entries are loaded with pd.read_pickle, so CACHE_DIR must be trusted.
+
+        Parameters
+        ----------
+        url : str
+            The API endpoint URL.
+        params : dict
+            The parameters to be sent with the API request.
+        expire_after : float, optional
+            Maximum age of a cache entry in seconds. None means entries never expire.
+        final_after : float, optional
+            Unix timestamp after which the data no longer changes. Entries saved after it
+            never expire, entries saved before it expire after expire_after.
+
+        Returns
+        -------
+        Tuple[str, Optional[pd.DataFrame]]
+            The cache key, and a copy of the cached DataFrame or None on a cache miss.
+        """
+        key = self._cache_key(url, params)
+        now = time.time()
+
+        with _memory_cache_lock:
+            entry = _memory_cache.get(key)
+            if entry is not None:
+                saved_at, df = entry
+                if self._is_fresh(saved_at, now, expire_after, final_after):
+                    _memory_cache.move_to_end(key)
+                    return key, df.copy()
+                del _memory_cache[key]
+
+        if not CACHE_DIR:
+            return key, None
+        path = os.path.join(CACHE_DIR, f"{key}.pkl")
+        try:
+            saved_at = os.path.getmtime(path)
+            if not self._is_fresh(saved_at, now, expire_after, final_after):
+                return key, None
+            df = pd.read_pickle(path)
+        except Exception:
+            # missing, unreadable or partially written cache files are treated as a miss
+            return key, None
+
+        self._save_to_memory_cache(key, df, saved_at)
+        return key, df.copy()
+
+    def _save_to_cache(self, df: pd.DataFrame, key: str) -> None:
+        """
+        Save a processed API response to the in-memory and on-disk caches.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The processed API response.
+        key : str
+            The cache key returned by `_get_from_cache_url_params`.
+        """
+        saved_at = time.time()
+        self._save_to_memory_cache(key, df.copy(), saved_at)
+        if not CACHE_DIR:
+            return
+
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, f"{key}.pkl")
+            # write to a temporary file first so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            # the on-disk cache is best effort, e.g. on a read-only file system
+            pass
+
+        if saved_at - _disk_cache_pruned_at >= CACHE_PRUNE_INTERVAL:
+            self._prune_disk_cache(saved_at)
+
+    @staticmethod
+    def _prune_disk_cache(now: float) -> None:
+        """
+        Delete the on-disk cache files, and leftover temporary files, older than CACHE_MAX_AGE.
+
+        Parameters
+        ----------
+        now : float
+            The current time, as a timestamp.
+        """
+        global _disk_cache_pruned_at
+        _disk_cache_pruned_at = now
+        try:
+            with os.scandir(CACHE_DIR) as entries:
+                for entry in entries:
+                    if not entry.name.endswith((".pkl", ".tmp")):
+                        continue
+                    try:
+                        if now - entry.stat().st_mtime >= CACHE_MAX_AGE:
+                            os.remove(entry.path)
+                    except OSError:
+                        # e.g. removed by another process in the meantime
+                        pass
+        except OSError:
+            pass
+
+    @staticmethod
+    def _get_stale_from_cache(keys: List[str], error: Exception) -> Optional[List[pd.DataFrame]]:
+        """
+        Get processed API responses from the on-disk cache, regardless of their age.
+
+        Used when the API cannot be reached, so a forecast can still be made from expired data.
+        Entries older than CACHE_MAX_AGE have been pruned and are not available.
+
+        Parameters
+        ----------
+        keys : List[str]
+            The cache keys returned by `_get_from_cache_url_params`.
+        error : Exception
+            The error of the failed API request, included in the warning.
+
+        Returns
+        -------
+        Optional[List[pd.DataFrame]]
+            The cached DataFrames in the order of keys, or None if any of them is not cached.
+        """
+        if not CACHE_DIR:
+            return None
+        try:
+            stale = [pd.read_pickle(os.path.join(CACHE_DIR, f"{key}.pkl")) for key in keys]
+        except Exception:
+            return None
+        warnings.warn(f"Weather data request failed ({error}), using expired cached data instead.")
+        return stale
+
+    @staticmethod
+    def _save_to_memory_cache(key: str, df: pd.DataFrame, saved_at: float) -> None:
+        with _memory_cache_lock:
+            _memory_cache[key] = (saved_at, df)
+            _memory_cache.move_to_end(key)
+            while len(_memory_cache) > MEMORY_CACHE_SIZE:
+                _memory_cache.popitem(last=False)
+
+    def get_hourly_weather_data_with_forecast(
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Get hourly weather data with forecast.
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude of the location.
+        longitude : float
+            Longitude of the location.
+        start_date : str
+            Start date in format YYYY-MM-DD.
+        end_date : str
+            End date in format YYYY-MM-DD.
+        variables : List[str], optional
+            Hourly variables to request. Defaults to HOURLY_VARIABLES.
+
+        Returns
+        -------
+        pd.DataFrame
+            Hourly weather data with forecast.
+        """
+        url = FORECAST_URL
+        params = self._forecast_params(
+            latitude, longitude, start_date, end_date, "hourly", variables
+        )
+        key, response = self._get_from_cache_url_params(
+            url, params, final_after=self._forecast_final_after(end_date)
+        )
         if response is None:
-            response = self.data_fetcher.fetch_data(url, params)
+            try:
+                response = self.data_fetcher.fetch_data(url, params)
+            except _FETCH_ERRORS as error:
+                stale = self._get_stale_from_cache([key], error)
+                if stale is None:
+                    raise
+                return stale[0]
             response = self.data_processor.process_hourly_data(response, params)
             self._save_to_cache(df=response, key=key)
 
         return response
 
     def get_15_minutely_weather_data_with_forecast(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """
         Get 15-minutely weather data with forecast.
@@ -268,46 +829,162 @@ class WeatherDataHandler:
             Start date in format YYYY-MM-DD.
         end_date : str
             End date in format YYYY-MM-DD.
+        variables : List[str], optional
+            15-minutely variables to request. Defaults to MINUTELY_15_VARIABLES.
 
         Returns
         -------
         pd.DataFrame
             15-minutely weather data with forecast.
         """
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "minutely_15": [
-                "temperature_2m",
-                "relative_humidity_2m",
-                "dew_point_2m",
-                "precipitation",
-                "surface_pressure",
-                "cloud_cover",
-                "cloud_cover_low",
-                "cloud_cover_mid",
-                "cloud_cover_high",
-                "wind_speed_10m",
-                "wind_direction_10m",
-                "is_day",
-                "shortwave_radiation",
-                "direct_radiation",
-                "diffuse_radiation",
-                "direct_normal_irradiance",
-                "terrestrial_radiation",
-            ],
-            "timezone": "GMT",
-            "start_date": start_date,
-            "end_date": end_date,
-        }
-       
-        response = self.data_fetcher.fetch_data(url, params)
-        response = self.data_processor.process_minutely_15_data(response, params)
+        url = FORECAST_URL
+        params = self._forecast_params(
+            latitude, longitude, start_date, end_date, "minutely_15", variables
+        )
+        key, response = self._get_from_cache_url_params(
+            url, params, final_after=self._forecast_final_after(end_date)
+        )
+        if response is None:
+            try:
+                response = self.data_fetcher.fetch_data(url, params)
+            except _FETCH_ERRORS as error:
+                stale = self._get_stale_from_cache([key], error)
+                if stale is None:
+                    raise
+                return stale[0]
+            response = self.data_processor.process_minutely_15_data(response, params)
+            self._save_to_cache(df=response, key=key)
+
         return response
 
+    def get_15_minutely_weather_data_with_forecast_batch(
+        self, points: List[Tuple[float, float, str, str]], variables: Optional[List[str]] = None
+    ) -> List[pd.DataFrame]:
+        """
+        Get 15-minutely weather data with forecast for several locations.
+
+        Requests that are not cached are sent to the API concurrently.
+
+        Parameters
+        ----------
+        points : List[Tuple[float, float, str, str]]
+            Latitude, longitude, start date and end date (in format YYYY-MM-DD) of each request.
+        variables : List[str], optional
+            15-minutely variables to request. Defaults to MINUTELY_15_VARIABLES.
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            15-minutely weather data with forecast, in the order of points.
+        """
+        url = FORECAST_URL
+        params_list = [
+            self._forecast_params(
+                latitude, longitude, start_date, end_date, "minutely_15", variables
+            )
+            for latitude, longitude, start_date, end_date in points
+        ]
+        keys, results = [], []
+        for params in params_list:
+            key, response = self._get_from_cache_url_params(
+                url, params, final_after=self._forecast_final_after(params["end_date"])
+            )
+            keys.append(key)
+            results.append(response)
+
+        missing = [i for i, response in enumerate(results) if response is None]
+        if missing:
+            try:
+                responses = self.data_fetcher.fetch_data_batch(
+                    url, [params_list[i] for i in missing]
+                )
+            except _FETCH_ERRORS as error:
+                stale = self._get_stale_from_cache([keys[i] for i in missing], error)
+                if stale is None:
+                    raise
+                for i, response in zip(missing, stale):
+                    results[i] = response
+                return results
+            for i, response in zip(missing, responses):
+                results[i] = self.data_processor.process_minutely_15_data(response, params_list[i])
+                self._save_to_cache(df=results[i], key=keys[i])
+
+        return results
+
+    def get_combined_forecast(
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        hourly_variables: Optional[List[str]] = None,
+        minutely_15_variables: Optional[List[str]] = None,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Get 15-minutely and hourly weather data with forecast from a single API request.
+
+        Both results are cached under the same keys as the separate hourly and 15-minutely
+        requests, so either can be served from the cache afterwards.
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude of the location.
+        longitude : float
+            Longitude of the location.
+        start_date : str
+            Start date in format YYYY-MM-DD.
+        end_date : str
+            End date in format YYYY-MM-DD.
+        hourly_variables : List[str], optional
+            Hourly variables to request. Defaults to HOURLY_VARIABLES.
+        minutely_15_variables : List[str], optional
+            15-minutely variables to request. Defaults to MINUTELY_15_VARIABLES.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame]
+            15-minutely and hourly weather data with forecast.
+        """
+        url = FORECAST_URL
+        minutely_15_params = self._forecast_params(
+            latitude, longitude, start_date, end_date, "minutely_15", minutely_15_variables
+        )
+        hourly_params = self._forecast_params(
+            latitude, longitude, start_date, end_date, "hourly", hourly_variables
+        )
+        final_after = self._forecast_final_after(end_date)
+        minutely_15_key, minutely_15 = self._get_from_cache_url_params(
+            url, minutely_15_params, final_after=final_after
+        )
+        hourly_key, hourly = self._get_from_cache_url_params(
+            url, hourly_params, final_after=final_after
+        )
+        if minutely_15 is None or hourly is None:
+            params = {**minutely_15_params, **hourly_params}
+            try:
+                response = self.data_fetcher.fetch_data(url, params)
+            except _FETCH_ERRORS as error:
+                stale = self._get_stale_from_cache([minutely_15_key, hourly_key], error)
+                if stale is None:
+                    raise
+                return stale[0], stale[1]
+            if minutely_15 is None:
+                minutely_15 = self.data_processor.process_minutely_15_data(response, params)
+                self._save_to_cache(df=minutely_15, key=minutely_15_key)
+            if hourly is None:
+                hourly = self.data_processor.process_hourly_data(response, params)
+                self._save_to_cache(df=hourly, key=hourly_key)
+
+        return minutely_15, hourly
+
     def get_weather_data_historical(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """
         Get historical weather data.
@@ -322,41 +999,28 @@ class WeatherDataHandler:
             Start date in format YYYY-MM-DD.
         end_date : str
             End date in format YYYY-MM-DD.
+        variables : List[str], optional
+            Hourly variables to request. Defaults to HISTORICAL_VARIABLES.
 
         Returns
         -------
         pd.DataFrame
             Historical weather data.
         """
-        url = "https://archive-api.open-meteo.com/v1/archive"
+        url = ARCHIVE_URL
         params = {
             "latitude": latitude,
             "longitude": longitude,
-            "hourly": [
-                "temperature_2m",
-                "relative_humidity_2m",
-                "dew_point_2m",
-                "precipitation",
-                "surface_pressure",
-                "cloud_cover",
-                "cloud_cover_low",
-                "cloud_cover_mid",
-                "cloud_cover_high",
-                "wind_speed_10m",
-                "wind_direction_10m",
-                "is_day",
-                "shortwave_radiation",
-                "direct_radiation",
-                "diffuse_radiation",
-                "direct_normal_irradiance",
-                "terrestrial_radiation",
-            ],
+            "hourly": _join_variables(variables, _HISTORICAL_VARIABLES_CSV),
             "start_date": start_date,
             "end_date": end_date,
         }
-
-        response = self.data_fetcher.fetch_data(url, params)
-        response = self.data_processor.process_historical_data(response, params)
+        # archived data does not change, so it is cached without expiry
+        key, response = self._get_from_cache_url_params(url, params, expire_after=None)
+        if response is None:
+            response = self.data_fetcher.fetch_data(url, params)
+            response = self.data_processor.process_historical_data(response, params)
+            self._save_to_cache(df=response, key=key)
 
         return response
 
@@ -369,7 +1033,7 @@ class WeatherService:
         This class provides high-level weather-related functionality using OpenMeteo API.
         """
         api_client = OpenMeteoAPIClient()
-        data_fetcher = WeatherDataFetcher(api_client)
+        data_fetcher = WeatherDataFetcher(api_client, AsyncOpenMeteoAPIClient())
         data_processor = WeatherDataProcessor()
         self.data_handler = WeatherDataHandler(api_client, data_fetcher, data_processor)
 
@@ -391,12 +1055,37 @@ class WeatherService:
         """
         # Valid range for latitude: -90 to 90
         # Valid range for longitude: -180 to 180
+        # NaN fails every comparison, so it is rejected together with infinite values
         if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
             raise ValueError(
                 "Invalid coordinates. Latitude must be between -90 and 90, and longitude must be"
                 " between -180 and 180."
             )
 
+    def _validate_coordinates_batch(self, latitudes: np.ndarray, longitudes: np.ndarray) -> None:
+        """
+        Validate the latitude and longitude coordinates of several locations at once.
+
+        Parameters
+        ----------
+        latitudes : np.ndarray
+            The latitude values to be checked.
+        longitudes : np.ndarray
+            The longitude values to be checked.
+
+        Raises
+        ------
+        ValueError
+            If any of the coordinates are not within valid ranges.
+        """
+        valid = (-90 <= latitudes) & (latitudes <= 90) & (-180 <= longitudes) & (longitudes <= 180)
+        if not valid.all():
+            invalid = np.flatnonzero(~valid)
+            raise ValueError(
+                "Invalid coordinates. Latitude must be between -90 and 90, and longitude must be"
+                f" between -180 and 180. Got invalid coordinates for points {invalid.tolist()}."
+            )
+
     def _validate_date_format(self, start_date: str, end_date: str) -> None:
         """
         Validate date format and check if end_date is greater than start_date.
@@ -413,17 +1102,47 @@ class WeatherService:
         ValueError
             If date format is invalid or end_date is not greater than start_date.
         """
-        try:
-            start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
-            end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
-
-            if end_datetime < start_datetime:
-                raise ValueError("End date must be greater than start date.")
-        except ValueError:
+        start = self._parse_date(start_date)
+        end = self._parse_date(end_date)
+        if start is None or end is None:
             raise ValueError(f"Invalid date format. Please use YYYY-MM-DD. Got {start_date} and {end_date}.")
 
+        # (year, month, day) tuples compare in date order
+        if end < start:
+            raise ValueError("End date must be greater than start date.")
+
+    @staticmethod
+    def _parse_date(date: str) -> Optional[Tuple[int, int, int]]:
+        """
+        Parse a date in format YYYY-MM-DD.
+
+        Parameters
+        ----------
+        date : str
+            The date to parse.
+
+        Returns
+        -------
+        Optional[Tuple[int, int, int]]
+            The year, month and day, or None if it is not a valid date in format YYYY-MM-DD.
+        """
+        # much faster than datetime.strptime, which is called twice for every request
+        match = _DATE_RE.fullmatch(date) if isinstance(date, str) else None
+        if match is None:
+            return None
+        year, month, day = map(int, match.groups())
+        # reject e.g. a 13th month or the 30th of February
+        if not (1 <= year and 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]):
+            return None
+        return year, month, day
+
     def get_hourly_weather(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """
         Get hourly weather data ranging from 3 months ago up to 15 days ahead (forecast).
@@ -438,6 +1157,8 @@ class WeatherService:
             The start date for the weather data, in the format YYYY-MM-DD.
         end_date : str
             The end date for the weather data, in the format YYYY-MM-DD.
+        variables : List[str], optional
+            The hourly weather variables to get. Defaults to HOURLY_VARIABLES.
 
         Returns
         -------
@@ -454,11 +1175,16 @@ class WeatherService:
         self._validate_coordinates(latitude, longitude)
         self._validate_date_format(start_date, end_date)
         return self.data_handler.get_hourly_weather_data_with_forecast(
-            latitude, longitude, start_date, end_date
+            latitude, longitude, start_date, end_date, variables
         )
 
     def get_minutely_weather(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """
         Get 15 minutely weather data ranging from 3 months ago up to 15 days ahead (forecast).
@@ -472,6 +1198,8 @@ class WeatherService:
             The start date for the weather data, in the format YYYY-MM-DD.
         end_date : str
             The end date for the weather data, in the format YYYY-MM-DD.
+        variables : List[str], optional
+            The 15 minutely weather variables to get. Defaults to MINUTELY_15_VARIABLES.
 
         Returns
         -------
@@ -488,11 +1216,94 @@ class WeatherService:
         self._validate_coordinates(latitude, longitude)
         self._validate_date_format(start_date, end_date)
         return self.data_handler.get_15_minutely_weather_data_with_forecast(
-            latitude, longitude, start_date, end_date
+            latitude, longitude, start_date, end_date, variables
+        )
+
+    def get_minutely_weather_batch(
+        self, points: List[Tuple[float, float, str, str]], variables: Optional[List[str]] = None
+    ) -> List[pd.DataFrame]:
+        """
+        Get 15 minutely weather data for several locations, fetched concurrently.
+
+        Parameters
+        ----------
+        points : List[Tuple[float, float, str, str]]
+            The latitude, longitude, start date and end date (in the format YYYY-MM-DD) of each
+            location for which to get weather data.
+        variables : List[str], optional
+            The 15 minutely weather variables to get. Defaults to MINUTELY_15_VARIABLES.
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            A DataFrame containing the 15 minutely weather data for each location and date
+            range, in the order of points.
+
+        Raises
+        ------
+        ValueError
+            If any of the provided coordinates are not within valid ranges, or if any date format
+            is invalid, or if any end_date is not greater than its start_date.
+        """
+        coordinates = np.array([point[:2] for point in points], dtype=np.float64).reshape(-1, 2)
+        self._validate_coordinates_batch(coordinates[:, 0], coordinates[:, 1])
+        for _, _, start_date, end_date in points:
+            self._validate_date_format(start_date, end_date)
+        return self.data_handler.get_15_minutely_weather_data_with_forecast_batch(points, variables)
+
+    def get_combined_weather(
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        hourly_variables: Optional[List[str]] = None,
+        minutely_15_variables: Optional[List[str]] = None,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Get 15 minutely and hourly weather data ranging from 3 months ago up to 15 days ahead
+        (forecast), using a single request to the OpenMeteo API.
+
+        Parameters
+        ----------
+        latitude : float
+            The latitude of the location for which to get weather data.
+        longitude : float
+            The longitude of the location for which to get weather data.
+        start_date : str
+            The start date for the weather data, in the format YYYY-MM-DD.
+        end_date : str
+            The end date for the weather data, in the format YYYY-MM-DD.
+        hourly_variables : List[str], optional
+            The hourly weather variables to get. Defaults to HOURLY_VARIABLES.
+        minutely_15_variables : List[str], optional
+            The 15 minutely weather variables to get. Defaults to MINUTELY_15_VARIABLES.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame]
+            DataFrames containing the 15 minutely and the hourly weather data for the specified
+            location and date range. The data includes both historical and forecast data.
+
+        Raises
+        ------
+        ValueError
+            If the provided coordinates are not within valid ranges, or if the date format is
+            invalid, or if the end_date is not greater than the start_date.
+        """
+        self._validate_coordinates(latitude, longitude)
+        self._validate_date_format(start_date, end_date)
+        return self.data_handler.get_combined_forecast(
+            latitude, longitude, start_date, end_date, hourly_variables, minutely_15_variables
         )
 
     def get_historical_weather(
-        self, latitude: float, longitude: float, start_date: str, end_date: str
+        self,
+        latitude: float,
+        longitude: float,
+        start_date: str,
+        end_date: str,
+        variables: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """
         Get hourly weather data ranging from 1940 up to 5 days ago.
@@ -506,6 +1317,8 @@ class WeatherService:
             The start date for the weather data, in the format YYYY-MM-DD.
         end_date : str
             The end date for the weather data, in the format YYYY-MM-DD.
+        variables : List[str], optional
+            The hourly weather variables to get. Defaults to HISTORICAL_VARIABLES.
 
         Returns
         -------
@@ -522,5 +1335,5 @@ class WeatherService:
         self._validate_coordinates(latitude, longitude)
         self._validate_date_format(start_date, end_date)
         return self.data_handler.get_weather_data_historical(
-            latitude, longitude, start_date, end_date
+            latitude, longitude, start_date, end_date, variables
         )
\ No newline at end of file
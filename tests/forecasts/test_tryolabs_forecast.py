@@ -0,0 +1,226 @@
+import datetime
+import os
+import shutil
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from xgboost import XGBRegressor
+
+from quartz_solar_forecast.forecasts import tryolabs_forecast
+from quartz_solar_forecast.forecasts.tryolabs_forecast import (
+    DATE_FEATURES,
+    PANEL_COLUMNS,
+    SolarPowerPredictor,
+    _date_features,
+)
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.open_meteo import MINUTELY_15_VARIABLES
+
+# the order of the features in the training data of the model
+FEATURES = PANEL_COLUMNS + list(MINUTELY_15_VARIABLES) + DATE_FEATURES
+
+
+def make_weather_data(latitude: float, start_date: str, end_date: str, freq: str) -> pd.DataFrame:
+    """Weather data from the start of start_date up to the end of end_date, like the API"""
+    dates = pd.date_range(
+        start_date, pd.Timestamp(end_date) + pd.Timedelta(days=1), freq=freq, inclusive="left"
+    )
+    rng = np.random.default_rng(int(latitude * 1000))
+    weather_data = pd.DataFrame(
+        rng.random((len(dates), len(MINUTELY_15_VARIABLES)), dtype=np.float32) * 100,
+        columns=list(MINUTELY_15_VARIABLES),
+    )
+    weather_data.insert(0, "date", dates)
+    return weather_data
+
+
+class FakeWeatherService:
+    """Makes weather data instead of requesting it, and records the requested dates"""
+
+    requests = []
+
+    def get_minutely_weather(self, latitude, longitude, start_date, end_date, variables=None):
+        self.requests.append(("minutely_15", start_date, end_date))
+        return make_weather_data(latitude, start_date, end_date, "15min")
+
+    def get_historical_weather(self, latitude, longitude, start_date, end_date, variables=None):
+        self.requests.append(("historical", start_date, end_date))
+        return make_weather_data(latitude, start_date, end_date, "1h")
+
+    def get_minutely_weather_batch(self, points, variables=None):
+        return [self.get_minutely_weather(*point) for point in points]
+
+
+@pytest.fixture(autouse=True)
+def weather_service(monkeypatch):
+    monkeypatch.setattr(tryolabs_forecast, "WeatherService", FakeWeatherService)
+    FakeWeatherService.requests = []
+    return FakeWeatherService
+
+
+def fit_model(path, feature_names: bool) -> str:
+    rng = np.random.default_rng(0)
+    X = rng.random((500, len(FEATURES)), dtype=np.float32)
+    # every feature matters, so predictions change if the features are put in another order
+    y = X @ np.arange(1, len(FEATURES) + 1)
+    model = XGBRegressor(n_estimators=20, max_depth=4)
+    model.fit(pd.DataFrame(X, columns=FEATURES) if feature_names else X, y)
+    joblib.dump(model, path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    return fit_model(tmp_path_factory.mktemp("model") / "model.joblib", feature_names=True)
+
+
+SITES = [
+    PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25),
+    PVSite(latitude=40.0, longitude=3.5, capacity_kwp=4.0, tilt=20, orientation=160),
+]
+
+
+def test_date_features():
+    # the historical weather API goes back to 1940, so dates before 1970 are included
+    dates = pd.Series(pd.date_range("1940-01-01", "2030-12-31", freq="997min"))
+
+    features = _date_features(dates.values)
+
+    expected = np.column_stack([getattr(dates.dt, feature) for feature in DATE_FEATURES])
+    assert features.dtype == np.int16
+    np.testing.assert_array_equal(features, expected)
+
+
+def test_batch_predictions_match_single_site_predictions(model_path):
+    predictor = SolarPowerPredictor(model_path)
+    start_date = datetime.date.today()
+
+    predictions = predictor.predict_power_output_batch(SITES, start_date)
+
+    assert len(predictions) == len(SITES)
+    for site, site_predictions in zip(SITES, predictions):
+        expected = predictor.predict_power_output(
+            site.latitude,
+            site.longitude,
+            start_date,
+            site.capacity_kwp,
+            site.orientation,
+            site.tilt,
+        )
+        pd.testing.assert_frame_equal(site_predictions, expected)
+
+
+def test_empty_batch(model_path):
+    predictor = SolarPowerPredictor(model_path)
+
+    assert predictor.predict_power_output_batch([], datetime.date.today()) == []
+
+
+def test_compiled_model_with_more_threads_than_cores(tmp_path, monkeypatch):
+    pytest.importorskip("tl2cgen")
+    pytest.importorskip("treelite")
+    if shutil.which("gcc") is None:
+        pytest.skip("compiling the model requires gcc")
+    model_path = fit_model(tmp_path / "model.joblib", feature_names=True)
+    n_threads = (os.cpu_count() or 1) + 1
+
+    predictor = SolarPowerPredictor(model_path, compile_model=True, n_threads=n_threads)
+
+    assert predictor.predictor is not None
+    predictions = predictor.predict_power_output(51.75, -1.25, datetime.date.today(), 1.25, 180, 35)
+    # the same predictions as the XGBoost booster
+    monkeypatch.setattr(tryolabs_forecast, "tl2cgen", None)
+    expected = SolarPowerPredictor(model_path, n_threads=n_threads).predict_power_output(
+        51.75, -1.25, datetime.date.today(), 1.25, 180, 35
+    )
+    np.testing.assert_allclose(predictions["power_wh"], expected["power_wh"], rtol=1e-5)
+
+
+def predict_window(predictor, start_time: datetime.datetime) -> pd.DataFrame:
+    # the arguments run_xgboost_forecast passes for a 48 hour forecast from start_time
+    return predictor.predict_power_output(
+        51.75,
+        -1.25,
+        start_date=start_time,
+        kwp=1.25,
+        orientation=180,
+        tilt=35,
+        start_time=start_time,
+        end_time=start_time + datetime.timedelta(hours=48),
+    )
+
+
+def test_forecast_window_starting_during_the_day(model_path, weather_service):
+    start_time = datetime.datetime.combine(datetime.date.today(), datetime.time(10, 15))
+
+    predictions = predict_window(SolarPowerPredictor(model_path), start_time)
+
+    # the window ends on the third day, so its weather data is fetched too
+    end_date = (start_time + datetime.timedelta(days=2)).date().isoformat()
+    assert weather_service.requests == [("minutely_15", start_time.date().isoformat(), end_date)]
+    assert len(predictions) == 192
+    assert predictions["date"].iloc[0] == start_time
+    assert predictions["date"].iloc[-1] == start_time + datetime.timedelta(hours=47, minutes=45)
+    assert predictions["date"].diff().iloc[1:].eq(pd.Timedelta(minutes=15)).all()
+
+
+def test_forecast_window_starting_at_midnight(model_path, weather_service):
+    start_time = datetime.datetime.combine(datetime.date.today(), datetime.time())
+
+    predictions = predict_window(SolarPowerPredictor(model_path), start_time)
+
+    # the window ends at midnight of the third day, which is not fetched
+    end_date = (start_time + datetime.timedelta(days=1)).date().isoformat()
+    assert weather_service.requests == [("minutely_15", start_time.date().isoformat(), end_date)]
+    assert len(predictions) == 192
+    assert predictions["date"].iloc[0] == start_time
+    assert predictions["date"].iloc[-1] == start_time + datetime.timedelta(hours=47, minutes=45)
+
+
+def test_forecast_window_with_hourly_historical_data(model_path, weather_service):
+    start_time = datetime.datetime(2023, 6, 1, 10, 0)
+
+    predictions = predict_window(SolarPowerPredictor(model_path), start_time)
+
+    assert weather_service.requests == [("historical", "2023-06-01", "2023-06-03")]
+    assert len(predictions) == 48
+    assert predictions["date"].iloc[0] == start_time
+    assert predictions["date"].iloc[-1] == start_time + datetime.timedelta(hours=47)
+
+
+def test_forecast_window_with_a_timezone_aware_start_time(model_path, weather_service):
+    tz = datetime.timezone(datetime.timedelta(hours=2))
+    start_time = pd.Timestamp(datetime.datetime.combine(datetime.date.today(), datetime.time(1), tz))
+    utc_start_time = start_time.tz_convert("UTC").tz_localize(None)
+    predictor = SolarPowerPredictor(model_path)
+
+    predictions = predict_window(predictor, start_time)
+    batch_predictions = predictor.predict_power_output_batch(
+        SITES[:1], start_time, start_time, start_time + datetime.timedelta(hours=48)
+    )
+
+    # the weather data is in UTC, where the window starts on the day before
+    assert weather_service.requests[0][1] == utc_start_time.date().isoformat()
+    expected = predict_window(predictor, utc_start_time)
+    assert expected["date"].iloc[0] == utc_start_time
+    pd.testing.assert_frame_equal(predictions, expected)
+    pd.testing.assert_frame_equal(batch_predictions[0], expected)
+
+
+@pytest.mark.parametrize("feature_names", [True, False])
+def test_features_are_in_the_training_order(tmp_path, feature_names):
+    model_path = fit_model(tmp_path / "model.joblib", feature_names=feature_names)
+    predictor = SolarPowerPredictor(model_path)
+    start_date = datetime.date.today()
+
+    predictions = predictor.predict_power_output(51.75, -1.25, start_date, 1.25, 180, 35)
+
+    # the panel columns first, then the weather variables and the date features, like the
+    # columns were ordered before predicting
+    data = predictor.get_data(51.75, -1.25, start_date, 1.25, 180, 35)
+    data = data[PANEL_COLUMNS + [column for column in data.columns if column not in PANEL_COLUMNS]]
+    cleaned_data, _ = predictor.clean(data)
+    expected = predictor.model.predict(cleaned_data.to_numpy())
+    np.testing.assert_allclose(predictions["power_wh"], expected, rtol=1e-6)
@@ -1,4 +1,6 @@
-from quartz_solar_forecast.forecast import run_forecast
+import pytest
+
+from quartz_solar_forecast.forecast import run_forecast, run_xgboost_forecast_parallel
 from quartz_solar_forecast.pydantic_models import PVSite
 
 
@@ -12,3 +14,10 @@ def test_run_forecast():
     print(predications_df)
     print(f"Max: {predications_df['power_wh'].max()}")
 
+
+@pytest.mark.parametrize("n_workers", [0, -1])
+def test_run_xgboost_forecast_parallel_invalid_n_workers(n_workers):
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+
+    with pytest.raises(ValueError, match="n_workers must be at least 1"):
+        run_xgboost_forecast_parallel([site], model_path="model.joblib", n_workers=n_workers)
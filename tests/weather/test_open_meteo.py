@@ -0,0 +1,477 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from openmeteo_requests.Client import OpenMeteoRequestsError
+
+from quartz_solar_forecast.weather import open_meteo
+from quartz_solar_forecast.weather.open_meteo import (
+    AsyncOpenMeteoAPIClient,
+    OpenMeteoAPIClient,
+    OpenMeteoRateLimitError,
+    WeatherDataFetcher,
+    WeatherDataHandler,
+    WeatherDataProcessor,
+    WeatherService,
+)
+
+
+class FakeDataFetcher:
+    """Returns a constant processed response and counts the API calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.params = []
+
+    def fetch_data(self, url: str, params: dict):
+        self.calls += 1
+        self.params.append(params)
+        return None
+
+    def fetch_data_batch(self, url: str, params_list: list) -> list:
+        self.calls += 1
+        self.params.extend(params_list)
+        return [params["latitude"] for params in params_list]
+
+
+def make_weather_dataframe() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "date": pd.date_range("2024-06-01", periods=4, freq="15min"),
+            "temperature_2m": np.arange(4, dtype=np.float32),
+        }
+    )
+
+
+class FakeDataProcessor(WeatherDataProcessor):
+    @staticmethod
+    def process_minutely_15_data(response, params: dict) -> pd.DataFrame:
+        return make_weather_dataframe()
+
+    @staticmethod
+    def process_hourly_data(response, params: dict) -> pd.DataFrame:
+        return make_weather_dataframe()
+
+    @staticmethod
+    def process_historical_data(response, params: dict) -> pd.DataFrame:
+        return make_weather_dataframe()
+
+
+class LatitudeDataProcessor(FakeDataProcessor):
+    """Tells the responses of a batch apart, by the latitude returned by FakeDataFetcher"""
+
+    @staticmethod
+    def process_minutely_15_data(response, params: dict) -> pd.DataFrame:
+        df = make_weather_dataframe()
+        df["temperature_2m"] = np.float32(params["latitude"])
+        return df
+
+
+class FakeOpenMeteoHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the OpenMeteo API, with a size prefixed flatbuffers message that only holds the
+    requested latitude. Latitudes above 90 get a 400 error, latitudes below -90 are rate limited,
+    and requests with a lower latitude are answered later, so concurrent responses arrive out of
+    order.
+    """
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        latitude = float(query["latitude"][0])
+        if abs(latitude) > 90:
+            reason = "Latitude must be in range" if latitude > 0 else "Too many requests"
+            body = json.dumps({"error": True, "reason": reason}).encode()
+            self.send_response(400 if latitude > 0 else 429)
+            self.send_header("Content-Type", "application/json")
+        else:
+            time.sleep(max(0.0, 60 - latitude) * 0.01)
+            builder = flatbuffers.Builder(64)
+            builder.StartObject(1)
+            # the latitude is the first field of WeatherApiResponse
+            builder.PrependFloat32Slot(0, latitude, 0)
+            builder.FinishSizePrefixed(builder.EndObject())
+            body = bytes(builder.Output())
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeOpenMeteoServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # requests still in flight are cancelled by the client when another one fails
+        pass
+
+
+@pytest.fixture(scope="module")
+def api_url():
+    server = FakeOpenMeteoServer(("127.0.0.1", 0), FakeOpenMeteoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/forecast"
+    server.shutdown()
+
+
+def make_handler(tmp_path, monkeypatch) -> WeatherDataHandler:
+    monkeypatch.setattr(open_meteo, "CACHE_DIR", str(tmp_path))
+    open_meteo._memory_cache.clear()
+    return WeatherDataHandler(None, FakeDataFetcher(), FakeDataProcessor())
+
+
+def test_minutely_weather_is_cached(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+
+    first = handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    # callers add columns to the returned frame, this must not leak into the cache
+    first["kwp"] = 1.25
+    second = handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+
+    assert handler.data_fetcher.calls == 1
+    assert "kwp" not in second.columns
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+
+    # the on-disk cache is used once the in-memory cache is empty
+    open_meteo._memory_cache.clear()
+    third = handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    assert handler.data_fetcher.calls == 1
+    pd.testing.assert_frame_equal(second, third)
+
+
+def test_past_forecast_data_does_not_expire(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    today = datetime.now(timezone.utc).date()
+    recent = ((today - timedelta(days=1)).isoformat(), today.isoformat())
+    past = ("2024-06-01", "2024-06-03")
+
+    for start_date, end_date in (recent, past):
+        handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, start_date, end_date)
+    assert handler.data_fetcher.calls == 2
+
+    # age both cache entries beyond the forecast expiry
+    saved_at = datetime.now().timestamp() - 2 * open_meteo.CACHE_EXPIRE_AFTER
+    for path in tmp_path.glob("*.pkl"):
+        os.utime(path, (saved_at, saved_at))
+    open_meteo._memory_cache.clear()
+
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, *past)
+    assert handler.data_fetcher.calls == 2
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, *recent)
+    assert handler.data_fetcher.calls == 3
+
+
+def test_forecast_data_saved_before_it_is_final_expires(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    today = datetime.now(timezone.utc).date()
+    recent = ((today - timedelta(days=1)).isoformat(), today.isoformat())
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, *recent)
+
+    # days later the request is in the past, but the cached data is still an old forecast
+    later = time.time() + (open_meteo.FINAL_DATA_AFTER_DAYS + 2) * 24 * 60 * 60
+
+    class LaterDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(later, tz)
+
+    monkeypatch.setattr(open_meteo.time, "time", lambda: later)
+    monkeypatch.setattr(open_meteo, "datetime", LaterDatetime)
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, *recent)
+    assert handler.data_fetcher.calls == 2
+
+    # the data saved once it is final does not expire
+    for path in tmp_path.glob("*.pkl"):
+        os.utime(path, (later, later))
+    open_meteo._memory_cache.clear()
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, *recent)
+    assert handler.data_fetcher.calls == 2
+
+
+def test_requested_variables_are_passed_to_the_api(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+
+    handler.get_hourly_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    handler.get_hourly_weather_data_with_forecast(
+        51.75, -1.25, "2024-06-01", "2024-06-03", variables=["temperature_2m", "cloud_cover"]
+    )
+
+    # a subset of the variables is a different request, so it is not served from the cache
+    assert handler.data_fetcher.calls == 2
+    assert handler.data_fetcher.params[0]["hourly"] == ",".join(open_meteo.HOURLY_VARIABLES)
+    assert handler.data_fetcher.params[1]["hourly"] == "temperature_2m,cloud_cover"
+
+
+def test_variables_must_be_a_list(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+
+    # an empty list is not mistaken for the default variables
+    with pytest.raises(ValueError, match="must not be empty"):
+        handler.get_hourly_weather_data_with_forecast(
+            51.75, -1.25, "2024-06-01", "2024-06-03", variables=[]
+        )
+    with pytest.raises(ValueError, match="must not be empty"):
+        handler.get_15_minutely_weather_data_with_forecast_batch(
+            [(51.75, -1.25, "2024-06-01", "2024-06-03")], variables=[]
+        )
+    assert handler.data_fetcher.calls == 0
+
+    with pytest.raises(TypeError):
+        handler.get_hourly_weather_data_with_forecast(
+            51.75, -1.25, "2024-06-01", "2024-06-03", variables="temperature_2m"
+        )
+    with pytest.raises(TypeError):
+        handler.get_weather_data_historical(
+            51.75, -1.25, "2024-06-01", "2024-06-03", variables="temperature_2m"
+        )
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesLength(self):
+        return len(self.values)
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeVariablesWithTime:
+    def __init__(self, n_variables):
+        self.variables = [FakeVariable(np.full(4, i, dtype=np.float32)) for i in range(n_variables)]
+
+    def Variables(self, i):
+        return self.variables[i]
+
+    def Time(self):
+        return int(pd.Timestamp("2024-06-01").timestamp())
+
+    def Interval(self):
+        return 15 * 60
+
+
+class FakeResponse:
+    def Hourly(self):
+        return FakeVariablesWithTime(2)
+
+    def Minutely15(self):
+        return FakeVariablesWithTime(2)
+
+
+@pytest.mark.parametrize(
+    "variables", ["temperature_2m,cloud_cover", ["temperature_2m", "cloud_cover"]]
+)
+def test_processors_accept_joined_and_listed_variables(variables):
+    processor = WeatherDataProcessor()
+    for df in (
+        processor.process_minutely_15_data(FakeResponse(), {"minutely_15": variables}),
+        processor.process_hourly_data(FakeResponse(), {"hourly": variables}),
+        processor.process_historical_data(FakeResponse(), {"hourly": variables}),
+    ):
+        assert list(df.columns) == ["date", "temperature_2m", "cloud_cover"]
+        assert (df["cloud_cover"] == 1).all()
+
+
+@pytest.mark.parametrize(
+    "error",
+    [requests.ConnectionError("API unreachable"), OpenMeteoRateLimitError("Too many requests")],
+)
+def test_expired_data_is_used_when_the_api_fails(tmp_path, monkeypatch, error):
+    handler = make_handler(tmp_path, monkeypatch)
+    today = datetime.now(timezone.utc).date().isoformat()
+
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, today, today)
+    saved_at = datetime.now().timestamp() - 2 * open_meteo.CACHE_EXPIRE_AFTER
+    for path in tmp_path.glob("*.pkl"):
+        os.utime(path, (saved_at, saved_at))
+    open_meteo._memory_cache.clear()
+
+    def fetch_data(url: str, params: dict):
+        raise error
+
+    monkeypatch.setattr(handler.data_fetcher, "fetch_data", fetch_data)
+    with pytest.warns(UserWarning, match="using expired cached data"):
+        stale = handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, today, today)
+    pd.testing.assert_frame_equal(stale, make_weather_dataframe())
+
+    # without cached data the error is raised
+    with pytest.raises(type(error)):
+        handler.get_15_minutely_weather_data_with_forecast(51.0, -1.25, today, today)
+
+
+def test_invalid_requests_do_not_use_expired_data(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    today = datetime.now(timezone.utc).date().isoformat()
+
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, today, today)
+    saved_at = datetime.now().timestamp() - 2 * open_meteo.CACHE_EXPIRE_AFTER
+    for path in tmp_path.glob("*.pkl"):
+        os.utime(path, (saved_at, saved_at))
+    open_meteo._memory_cache.clear()
+
+    def fetch_data(url: str, params: dict):
+        raise OpenMeteoRequestsError("Cannot initialize WeatherVariable from invalid String value")
+
+    monkeypatch.setattr(handler.data_fetcher, "fetch_data", fetch_data)
+    with pytest.raises(OpenMeteoRequestsError):
+        handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, today, today)
+
+
+def test_old_cache_files_are_pruned(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    monkeypatch.setattr(open_meteo, "_disk_cache_pruned_at", 0.0)
+    old = tmp_path / "old.pkl"
+    old.write_bytes(b"")
+    saved_at = datetime.now().timestamp() - 2 * open_meteo.CACHE_MAX_AGE
+    os.utime(old, (saved_at, saved_at))
+
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+
+    assert not old.exists()
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+
+
+def test_disk_cache_can_be_disabled(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    monkeypatch.setattr(open_meteo, "CACHE_DIR", "")
+    monkeypatch.chdir(tmp_path)
+
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+
+    # the in-memory cache is still used
+    assert handler.data_fetcher.calls == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_key_rounds_coordinates():
+    params = {"latitude": 51.75, "longitude": -1.25, "start_date": "2024-06-01"}
+    nearby = {"latitude": 51.750001, "longitude": -1.249999, "start_date": "2024-06-01"}
+    other = {"latitude": 51.76, "longitude": -1.25, "start_date": "2024-06-01"}
+
+    url = "https://api.open-meteo.com/v1/forecast"
+    assert WeatherDataHandler._cache_key(url, params) == WeatherDataHandler._cache_key(url, nearby)
+    assert WeatherDataHandler._cache_key(url, params) != WeatherDataHandler._cache_key(url, other)
+
+
+def test_historical_weather_is_cached(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+
+    handler.get_weather_data_historical(51.75, -1.25, "2023-01-01", "2023-01-03")
+    handler.get_weather_data_historical(51.75, -1.25, "2023-01-01", "2023-01-03")
+
+    assert handler.data_fetcher.calls == 1
+
+
+def test_combined_forecast_fills_both_caches(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+
+    minutely_15, hourly = handler.get_combined_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    handler.get_15_minutely_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+    handler.get_hourly_weather_data_with_forecast(51.75, -1.25, "2024-06-01", "2024-06-03")
+
+    assert handler.data_fetcher.calls == 1
+
+
+def test_validate_date_format():
+    weather_service = WeatherService()
+
+    weather_service._validate_date_format("2024-02-28", "2024-02-29")
+    weather_service._validate_date_format("2024-06-01", "2024-06-01")
+
+    for start_date, end_date in [
+        ("2024-6-01", "2024-06-03"),
+        ("2024-06-01", "2024-06-03T00:00"),
+        ("2023-02-29", "2023-03-01"),
+        ("2024-13-01", "2024-13-02"),
+        (None, "2024-06-03"),
+    ]:
+        with pytest.raises(ValueError, match="Invalid date format"):
+            weather_service._validate_date_format(start_date, end_date)
+
+    with pytest.raises(ValueError, match="End date must be greater than start date"):
+        weather_service._validate_date_format("2024-06-03", "2024-06-01")
+
+
+def test_validate_coordinates():
+    weather_service = WeatherService()
+
+    weather_service._validate_coordinates(51.75, -1.25)
+    weather_service._validate_coordinates_batch(np.array([51.75, -90.0]), np.array([-1.25, 180.0]))
+
+    for latitude, longitude in [(91.0, 0.0), (0.0, -180.5), (np.nan, 0.0), (0.0, np.inf)]:
+        with pytest.raises(ValueError, match="Invalid coordinates"):
+            weather_service._validate_coordinates(latitude, longitude)
+        with pytest.raises(ValueError, match=r"points \[1\]"):
+            weather_service._validate_coordinates_batch(
+                np.array([51.75, latitude]), np.array([-1.25, longitude])
+            )
+
+
+def test_async_client_keeps_the_order_of_requests(api_url):
+    params_list = [{"latitude": latitude, "longitude": -1.25} for latitude in (51.0, 55.0, 52.0)]
+
+    responses = asyncio.run(AsyncOpenMeteoAPIClient().get_weather_data_batch(api_url, params_list))
+
+    assert [response[0].Latitude() for response in responses] == [51.0, 55.0, 52.0]
+
+
+def test_async_client_raises_api_errors(api_url):
+    params_list = [{"latitude": 51.0, "longitude": -1.25}, {"latitude": 91.0, "longitude": -1.25}]
+
+    with pytest.raises(OpenMeteoRequestsError, match="Latitude must be in range"):
+        asyncio.run(AsyncOpenMeteoAPIClient().get_weather_data_batch(api_url, params_list))
+
+
+def test_clients_raise_rate_limit_errors(api_url):
+    params = {"latitude": -91.0, "longitude": -1.25}
+
+    with pytest.raises(OpenMeteoRateLimitError, match="Too many requests"):
+        asyncio.run(AsyncOpenMeteoAPIClient().get_weather_data_batch(api_url, [params]))
+    with pytest.raises(OpenMeteoRateLimitError, match="Too many requests"):
+        OpenMeteoAPIClient().get_weather_data(api_url, dict(params))
+
+    # invalid requests are not mistaken for rate limits
+    with pytest.raises(OpenMeteoRequestsError) as excinfo:
+        OpenMeteoAPIClient().get_weather_data(api_url, {"latitude": 91.0, "longitude": -1.25})
+    assert not isinstance(excinfo.value, OpenMeteoRateLimitError)
+
+
+def test_fetch_data_batch_in_a_running_event_loop(api_url):
+    fetcher = WeatherDataFetcher(OpenMeteoAPIClient(), AsyncOpenMeteoAPIClient())
+    params_list = [{"latitude": latitude, "longitude": -1.25} for latitude in (53.0, 51.0)]
+
+    async def fetch():
+        # e.g. in a Jupyter notebook, where asyncio.run cannot be called
+        return fetcher.fetch_data_batch(api_url, params_list)
+
+    responses = asyncio.run(fetch())
+
+    assert [response.Latitude() for response in responses] == [53.0, 51.0]
+
+
+def test_batch_merges_cached_and_fetched_data(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    handler.data_processor = LatitudeDataProcessor()
+    handler.get_15_minutely_weather_data_with_forecast(52.0, -1.25, "2024-06-01", "2024-06-03")
+    handler.data_fetcher.params.clear()
+
+    results = handler.get_15_minutely_weather_data_with_forecast_batch(
+        [(latitude, -1.25, "2024-06-01", "2024-06-03") for latitude in (51.0, 52.0, 53.0)]
+    )
+
+    # only the points that were not cached are fetched, in a single batch
+    assert handler.data_fetcher.calls == 2
+    assert [params["latitude"] for params in handler.data_fetcher.params] == [51.0, 53.0]
+    assert [df["temperature_2m"].iloc[0] for df in results] == [51.0, 52.0, 53.0]